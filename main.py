@@ -1,13 +1,18 @@
 import discord
 from discord.ext import commands
 from flask import Flask, request, jsonify
-from threading import Thread
+from threading import Thread, Lock
 import os
 import gspread
 from google.oauth2.service_account import Credentials
 import json
 import asyncio
-from functools import partial
+import contextvars
+import time
+import cProfile
+import pstats
+from contextlib import contextmanager
+from functools import partial, wraps
 
 # Bot setup
 intents = discord.Intents.default()
@@ -31,9 +36,326 @@ PRODUCT_ROLE_MAP = {
 # Products that grant server access
 ACCESS_PRODUCTS = ['7995703263412', '7995706015924', '7996025995444']
 
+# Payment statuses that mean a product was cancelled
+CANCELLED_STATUSES = ['REFUNDED', 'CANCELLED']
+
+# ============================================
+# ENTITLEMENT VIEW - MATERIALIZED PER EMAIL
+# ============================================
+# email -> entitlement dict, rebuilt whenever that email's rows are read or written
+entitlements = {}
+# Discord User ID -> email of the entitlement that user owns
+entitlements_by_user_id = {}
+# Bumped on every per-email refresh so a bulk reload can tell which entries are newer
+entitlements_version = 0
+# email -> entitlements_version of its last per-email refresh
+entitlement_versions = {}
+entitlements_lock = Lock()
+
+def get_row_status(data):
+    """Payment status of a sheet row, upper-cased"""
+    status = data.get('Status') or data.get('Payment Status') or 'Unknown'
+    return str(status).strip().upper()
+
+def get_product_roles(product_ids):
+    """Union of PRODUCT_ROLE_MAP roles for the given product IDs"""
+    roles = set()
+    for product_id in product_ids:
+        role_names = PRODUCT_ROLE_MAP.get(product_id)
+        if isinstance(role_names, str):
+            roles.add(role_names)
+        elif role_names:
+            roles.update(role_names)
+    return roles
+
+def compute_entitlement(email, user_rows):
+    """Derive access, roles, owner and cancellations from a user's rows"""
+    products = set()
+    paid_products = set()
+    cancelled_products = set()
+    owner_id = ''
+    owner_username = ''
+    owner_from_access_product = False
+    verified_users = {}
+    verified_products = {}
+
+    for row in user_rows:
+        data = row['data']
+        product_id = str(data.get('Product ID', '')).strip()
+        status = get_row_status(data)
+        products.add(product_id)
+
+        if status == 'PAID':
+            paid_products.add(product_id)
+        elif status in CANCELLED_STATUSES:
+            cancelled_products.add(product_id)
+
+        # Track every verified Discord user; the owner prefers rows of ACCESS products
+        if str(data.get('Discord Verified', '')).strip().lower() != 'yes':
+            continue
+        discord_user_id = str(data.get('Discord User ID', '')).strip()
+        verified_products.setdefault(product_id, discord_user_id)
+        if discord_user_id:
+            verified_users.setdefault(discord_user_id, str(data.get('Discord Username', '')).strip())
+        if not discord_user_id or owner_from_access_product:
+            continue
+        if not owner_id or product_id in ACCESS_PRODUCTS:
+            owner_id = discord_user_id
+            owner_username = str(data.get('Discord Username', '')).strip()
+            owner_from_access_product = product_id in ACCESS_PRODUCTS
+
+    return {
+        'email': email,
+        'has_access': any(p in ACCESS_PRODUCTS for p in paid_products),
+        'roles': get_product_roles(paid_products),
+        'products': products,
+        'cancelled_products': cancelled_products,
+        'discord_user_id': owner_id,
+        'discord_username': owner_username,
+        # Every verified Discord User ID on any row -> its username
+        'verified_users': verified_users,
+        # Product ID -> Discord User ID of its first verified row, in row order
+        'verified_products': verified_products,
+    }
+
+def refresh_entitlement(email, user_rows):
+    """Recompute the entitlement for one email from its current rows"""
+    email = email.lower().strip()
+    entitlement = compute_entitlement(email, user_rows) if user_rows else None
+
+    global entitlements_version
+    with entitlements_lock:
+        entitlements_version += 1
+        entitlement_versions[email] = entitlements_version
+
+        previous = entitlements.get(email)
+        if previous and previous['discord_user_id'] and \
+           entitlements_by_user_id.get(previous['discord_user_id']) == email:
+            del entitlements_by_user_id[previous['discord_user_id']]
+
+        if entitlement:
+            entitlements[email] = entitlement
+            if entitlement['discord_user_id']:
+                entitlements_by_user_id[entitlement['discord_user_id']] = email
+        else:
+            entitlements.pop(email, None)
+
+    return entitlement
+
+def get_entitlements_version():
+    """Current refresh version, taken before a bulk read starts"""
+    with entitlements_lock:
+        return entitlements_version
+
+def replace_all_entitlements(records, read_version):
+    """Rebuild the whole entitlement view from every sheet record
+
+    Emails refreshed individually after read_version keep their newer entry.
+    """
+    rows_by_email = {}
+    for row_num, record in enumerate(records, start=2):
+        email = str(record.get('Email', '')).lower().strip()
+        if email:
+            rows_by_email.setdefault(email, []).append({
+                'row': row_num,
+                'data': record
+            })
+
+    new_entitlements = {}
+    for email, user_rows in rows_by_email.items():
+        new_entitlements[email] = compute_entitlement(email, user_rows)
+
+    with entitlements_lock:
+        for email, version in list(entitlement_versions.items()):
+            if version <= read_version:
+                # The bulk read already reflects this refresh
+                del entitlement_versions[email]
+            elif email in entitlements:
+                new_entitlements[email] = entitlements[email]
+            else:
+                new_entitlements.pop(email, None)
+
+        entitlements.clear()
+        entitlements.update(new_entitlements)
+        entitlements_by_user_id.clear()
+        for email, entitlement in new_entitlements.items():
+            if entitlement['discord_user_id']:
+                entitlements_by_user_id[entitlement['discord_user_id']] = email
+
+    return len(new_entitlements)
+
+def get_entitlement(email):
+    """Read the materialized entitlement for an email (None if never loaded)"""
+    with entitlements_lock:
+        return entitlements.get(email.lower().strip())
+
+def get_entitlement_by_user_id(discord_user_id):
+    """Read the entitlement owned by a Discord user (None if not known)"""
+    with entitlements_lock:
+        email = entitlements_by_user_id.get(str(discord_user_id))
+        return entitlements.get(email) if email else None
+
+# ============================================
+# PROFILING - OFF UNLESS PROFILING=1 OR !profile on
+# ============================================
+profiling_enabled = os.environ.get('PROFILING', '').lower() in ['1', 'true', 'yes']
+
+# name -> [calls, total seconds, max seconds]
+timing_counters = {}
+timing_lock = Lock()
+
+# Name of the profiled run (verify_email/process_webhook) the current code belongs to
+profile_scope = contextvars.ContextVar('profile_scope', default=None)
+# scope name -> pstats.Stats of Sheets helper calls, accumulated over every run of that scope
+profile_stats = {}
+profile_lock = Lock()
+# Held while a cProfile capture runs; Python 3.12+ allows one profiler per process
+profile_capture_lock = Lock()
+
+LOOP_LAG_INTERVAL = 0.5
+loop_lag = {'samples': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0}
+loop_lag_task = None
+
+def record_timing(name, elapsed):
+    """Add one call to the timing counter for name"""
+    with timing_lock:
+        counter = timing_counters.setdefault(name, [0, 0.0, 0.0])
+        counter[0] += 1
+        counter[1] += elapsed
+        counter[2] = max(counter[2], elapsed)
+
+@contextmanager
+def timer(name):
+    """Time the enclosed block (sync or awaited) when profiling is on"""
+    if not profiling_enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(name, time.perf_counter() - start)
+
+def timed(func):
+    """Decorator: count calls and wall time of a blocking function
+
+    Inside a profiled run, the call is also captured with cProfile under that
+    run's name, unless another capture is already running anywhere.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not profiling_enabled:
+            return func(*args, **kwargs)
+
+        scope = profile_scope.get()
+        profiler = None
+        if scope and profile_capture_lock.acquire(blocking=False):
+            try:
+                profiler = cProfile.Profile()
+                profiler.enable()
+            except ValueError:
+                # Some other profiling tool is active; just time the call
+                profiler = None
+                profile_capture_lock.release()
+
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record_timing(func.__name__, time.perf_counter() - start)
+            if profiler:
+                profiler.disable()
+                profile_capture_lock.release()
+                with profile_lock:
+                    if scope in profile_stats:
+                        profile_stats[scope].add(profiler)
+                    else:
+                        profile_stats[scope] = pstats.Stats(profiler)
+    return wrapper
+
+def profiled(func):
+    """Decorator: time a coroutine run and cProfile the Sheets helpers it calls
+
+    Marks the run as a profiling scope; helpers started through run_blocking
+    carry the scope into the executor thread, where timed() does the capture.
+    Captures are added to one cumulative Stats per scope, not kept per run.
+    """
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not profiling_enabled:
+            return await func(*args, **kwargs)
+
+        token = profile_scope.set(func.__name__)
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            profile_scope.reset(token)
+            record_timing(func.__name__, time.perf_counter() - start)
+    return wrapper
+
+async def monitor_loop_lag():
+    """Sample how late the event loop wakes up while profiling is on"""
+    loop = asyncio.get_event_loop()
+    while profiling_enabled:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - start - LOOP_LAG_INTERVAL)
+        loop_lag['samples'] += 1
+        loop_lag['total'] += lag
+        loop_lag['max'] = max(loop_lag['max'], lag)
+        loop_lag['last'] = lag
+
+def start_loop_lag_monitor():
+    """Start the loop lag sampler if it is not already running"""
+    global loop_lag_task
+    if loop_lag_task is None or loop_lag_task.done():
+        loop_lag_task = asyncio.get_event_loop().create_task(monitor_loop_lag())
+
+def reset_profiling():
+    """Clear all timing counters, cProfile captures and lag samples"""
+    with timing_lock:
+        timing_counters.clear()
+    with profile_lock:
+        profile_stats.clear()
+    loop_lag.update({'samples': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0})
+
+def format_hot_spots(limit=10):
+    """Render timing counters, cumulative Sheets-helper cProfile stats per scope and loop lag"""
+    lines = [f"Profiling: {'ON' if profiling_enabled else 'OFF'}", "", "Timed calls (total / calls / avg / max):"]
+
+    with timing_lock:
+        counters = sorted(timing_counters.items(), key=lambda item: item[1][1], reverse=True)
+    for name, (calls, total, slowest) in counters[:limit]:
+        lines.append(f"  {name}: {total:.3f}s / {calls} / {total / calls * 1000:.1f}ms / {slowest * 1000:.1f}ms")
+    if not counters:
+        lines.append("  (none)")
+
+    with profile_lock:
+        scopes = {scope: dict(stats.stats) for scope, stats in profile_stats.items()}
+    if not scopes:
+        lines.append("")
+        lines.append("cProfile: (no captures)")
+    for scope, functions in sorted(scopes.items()):
+        lines.append("")
+        lines.append(f"cProfile {scope} - Sheets helpers, all runs combined, by own time:")
+        functions = sorted(functions.items(), key=lambda item: item[1][2], reverse=True)
+        for (filename, line, name), (_, calls, own, cumulative, _) in functions[:limit]:
+            lines.append(f"  {os.path.basename(filename)}:{line}({name}): {own:.3f}s own / {cumulative:.3f}s cum / {calls} calls")
+
+    lines.append("")
+    samples = loop_lag['samples']
+    avg_lag = loop_lag['total'] / samples if samples else 0.0
+    lines.append(
+        f"Event loop lag: {samples} samples, avg {avg_lag * 1000:.1f}ms, "
+        f"max {loop_lag['max'] * 1000:.1f}ms, last {loop_lag['last'] * 1000:.1f}ms"
+    )
+    return "\n".join(lines)
+
 # ============================================
 # GOOGLE SHEETS - BLOCKING OPERATIONS
 # ============================================
+@timed
 def get_sheets_client():
     """Connect to Google Sheets - BLOCKING"""
     try:
@@ -53,6 +375,7 @@ def get_sheets_client():
         print(f"Error connecting to Google Sheets: {e}")
         return None
 
+@timed
 def get_worksheet():
     """Get the subscriber tracking worksheet - BLOCKING"""
     try:
@@ -68,6 +391,48 @@ def get_worksheet():
         print(f"Error getting worksheet: {e}")
         return None
 
+@timed
+def read_all_records(worksheet):
+    """Read every data row as a header -> value dict - BLOCKING"""
+    try:
+        return worksheet.get_all_records(empty2zero=False, head=1, default_blank='')
+    except Exception as e:
+        print(f"Error with get_all_records: {e}")
+        all_values = worksheet.get_all_values()
+        if len(all_values) < 2:
+            print("No data rows found in sheet")
+            return []
+        
+        headers = all_values[0]
+        records = []
+        for row in all_values[1:]:
+            record = {}
+            for i, header in enumerate(headers):
+                if i < len(row):
+                    record[header] = row[i]
+                else:
+                    record[header] = ''
+            records.append(record)
+        return records
+
+@timed
+def load_all_entitlements():
+    """Rebuild the entitlement view and user ID index from the whole sheet - BLOCKING"""
+    try:
+        read_version = get_entitlements_version()
+        worksheet = get_worksheet()
+        if not worksheet:
+            return None
+        
+        records = read_all_records(worksheet)
+        count = replace_all_entitlements(records, read_version)
+        print(f"Loaded entitlements for {count} email(s), {len(entitlements_by_user_id)} linked Discord user(s)")
+        return records
+    except Exception as e:
+        print(f"Error loading entitlements: {e}")
+        return None
+
+@timed
 def find_all_user_rows(email):
     """Find ALL rows for a user by email - BLOCKING"""
     try:
@@ -75,25 +440,7 @@ def find_all_user_rows(email):
         if not worksheet:
             return []
         
-        try:
-            records = worksheet.get_all_records(empty2zero=False, head=1, default_blank='')
-        except Exception as e:
-            print(f"Error with get_all_records: {e}")
-            all_values = worksheet.get_all_values()
-            if len(all_values) < 2:
-                print("No data rows found in sheet")
-                return []
-            
-            headers = all_values[0]
-            records = []
-            for row in all_values[1:]:
-                record = {}
-                for i, header in enumerate(headers):
-                    if i < len(row):
-                        record[header] = row[i]
-                    else:
-                        record[header] = ''
-                records.append(record)
+        records = read_all_records(worksheet)
         
         email = email.lower().strip()
         matching_rows = []
@@ -107,6 +454,7 @@ def find_all_user_rows(email):
                 })
         
         print(f"Found {len(matching_rows)} row(s) for email: {email}")
+        refresh_entitlement(email, matching_rows)
         return matching_rows
     except Exception as e:
         print(f"Error finding user in sheets: {e}")
@@ -114,6 +462,7 @@ def find_all_user_rows(email):
         traceback.print_exc()
         return []
 
+@timed
 def update_discord_verified_status_all_rows(email, discord_username, discord_user_id, verified=True):
     """Update Discord verification status for ALL rows - BLOCKING"""
     try:
@@ -141,60 +490,53 @@ def update_discord_verified_status_all_rows(email, discord_username, discord_use
         for user_row in user_rows:
             row_num = user_row['row']
             
+            # Mirror each write into the row data so the entitlement view stays current
             if discord_verified_col:
                 worksheet.update_cell(row_num, discord_verified_col, 'Yes' if verified else 'No')
+                user_row['data'][headers[discord_verified_col - 1]] = 'Yes' if verified else 'No'
             if discord_username_col:
                 worksheet.update_cell(row_num, discord_username_col, discord_username)
+                user_row['data'][headers[discord_username_col - 1]] = discord_username
             if discord_user_id_col:
                 worksheet.update_cell(row_num, discord_user_id_col, str(discord_user_id))
-            
+                user_row['data'][headers[discord_user_id_col - 1]] = str(discord_user_id)
+
             product_id = user_row['data'].get('Product ID', 'Unknown')
             print(f"Updated row {row_num} (Product {product_id}) for {email}: verified={verified}")
         
+        refresh_entitlement(email, user_rows)
         return True
     except Exception as e:
         print(f"Error updating sheets: {e}")
         return False
 
-def has_active_subscription(email):
-    """Check if user has an active subscription - BLOCKING"""
-    user_rows = find_all_user_rows(email)
-    
-    for row in user_rows:
-        product_id = str(row['data'].get('Product ID', '')).strip()
-        status = row['data'].get('Status') or row['data'].get('Payment Status', 'Unknown')
-        
-        if product_id in ACCESS_PRODUCTS and status.upper() == 'PAID':
-            return True
-    
-    return False
-
 # ============================================
 # ASYNC WRAPPERS FOR BLOCKING OPERATIONS
 # ============================================
+async def run_blocking(func, *args):
+    """Run a blocking helper in the executor, carrying the profiling scope along"""
+    loop = asyncio.get_event_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(None, partial(context.run, func, *args))
+
 async def async_find_all_user_rows(email):
     """Non-blocking wrapper for find_all_user_rows"""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, find_all_user_rows, email)
+    return await run_blocking(find_all_user_rows, email)
 
 async def async_update_discord_verified(email, discord_username, discord_user_id, verified=True):
     """Non-blocking wrapper for update_discord_verified_status_all_rows"""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(
-        None, 
+    return await run_blocking(
         update_discord_verified_status_all_rows,
         email, discord_username, discord_user_id, verified
     )
 
-async def async_has_active_subscription(email):
-    """Non-blocking wrapper for has_active_subscription"""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, has_active_subscription, email)
+async def async_load_all_entitlements():
+    """Non-blocking wrapper for load_all_entitlements"""
+    return await run_blocking(load_all_entitlements)
 
 async def async_get_worksheet():
     """Non-blocking wrapper for get_worksheet"""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, get_worksheet)
+    return await run_blocking(get_worksheet)
 
 # ============================================
 # BOT EVENTS
@@ -205,16 +547,30 @@ async def on_ready():
     print(f'Bot is in {len(bot.guilds)} servers')
     print(f'Webhook endpoint ready at: /webhook')
     
+    if profiling_enabled:
+        start_loop_lag_monitor()
+        print("⏱️ Profiling enabled - use !hotspots to view results")
+    
     # Test Google Sheets connection (non-blocking)
     worksheet = await async_get_worksheet()
     if worksheet:
         print(f"✅ Connected to Google Sheets: {worksheet.spreadsheet.title}")
+        # Warm the entitlement view so rejoining members can be restored without sheet reads
+        await async_load_all_entitlements()
     else:
         print("⚠️ Could not connect to Google Sheets - check credentials")
 
 @bot.event
 async def on_member_join(member):
-    """Send verification DM when someone joins"""
+    """Restore roles for known subscribers, otherwise send verification DM"""
+    # Already-verified paid members get their roles back straight from the view
+    entitlement = get_entitlement_by_user_id(member.id)
+    if entitlement and entitlement['has_access']:
+        assigned_roles = await assign_all_subscriber_roles(member, entitlement['email'])
+        if assigned_roles:
+            print(f"♻️ Restored roles {assigned_roles} for rejoining member {member.name} ({entitlement['email']})")
+            return
+    
     try:
         embed = discord.Embed(
             title="Welcome to Market Sniper! 🎉",
@@ -244,137 +600,138 @@ async def on_message(message):
     if isinstance(message.channel, discord.DMChannel):
         if '@' in message.content and '.' in message.content:
             email = message.content.strip().lower()
-            
-            # Non-blocking sheet lookup
-            user_rows = await async_find_all_user_rows(email)
-            
-            if user_rows:
-                # Check if ANY row has a different Discord user already verified
-                for row in user_rows:
-                    existing_discord_verified = row['data'].get('Discord Verified', '').lower()
-                    existing_discord_user_id = str(row['data'].get('Discord User ID', '')).strip()
-                    current_user_id = str(message.author.id)
-                    
-                    if existing_discord_verified == 'yes' and existing_discord_user_id and existing_discord_user_id != current_user_id:
-                        existing_username = row['data'].get('Discord Username', 'another user')
-                        await message.channel.send(
-                            f"🚫 **Email Already Registered**\n\n"
-                            f"The email `{email}` is already linked to another Discord account (`{existing_username}`).\n\n"
-                            f"If this is your email and you need to update your Discord account, please contact support."
-                        )
-                        print(f"⚠️ Blocked hijack attempt: {message.author.name} (ID: {current_user_id}) tried to use {email} (already owned by user ID {existing_discord_user_id})")
-                        return
-                
-                # Check if user has an active subscription (non-blocking)
-                has_access = await async_has_active_subscription(email)
-                
-                if not has_access:
-                    await message.channel.send(
-                        f"⚠️ **Setup Product Only**\n\n"
-                        f"The email `{email}` is registered, but you only have the setup fee product.\n\n"
-                        f"To get Discord access, you need to purchase a monthly or annual subscription. "
-                        f"The setup fee alone does not grant server access."
-                    )
-                    print(f"⚠️ User {email} tried to verify but only has setup product")
-                    return
-                
-                # If same user re-verifying
-                if user_rows[0]['data'].get('Discord Verified', '').lower() == 'yes' and \
-                   str(user_rows[0]['data'].get('Discord User ID', '')).strip() == str(message.author.id):
-                    await message.channel.send(
-                        f"ℹ️ You've already verified this email!\n\n"
-                        f"Your account is already linked and you have your role. "
-                        f"If you're missing your role, please contact support."
-                    )
-                    return
-                
-                # New verification - update ALL rows (non-blocking)
-                discord_username = f"{message.author.name}"
-                discord_user_id = str(message.author.id)
-                await async_update_discord_verified(email, discord_username, discord_user_id, True)
-                
-                await message.channel.send(
-                    f"✅ Email `{email}` verified!\n\n"
-                    f"Your subscription is confirmed. Assigning your roles now..."
-                )
-                
-                # Assign roles
-                guild = bot.guilds[0] if bot.guilds else None
-                if guild:
-                    member = guild.get_member(message.author.id)
-                    if member:
-                        assigned_roles = await assign_all_subscriber_roles(member, email)
-                        
-                        if assigned_roles:
-                            try:
-                                roles_text = ", ".join([f"**{r}**" for r in assigned_roles])
-                                await message.channel.send(
-                                    f"🎉 **Subscription Activated!**\n\n"
-                                    f"Your roles have been assigned: {roles_text}\n"
-                                    f"You now have access to all premium channels!"
-                                )
-                            except discord.Forbidden:
-                                pass
-                
-                print(f"✅ Email verified: {message.author.name} (ID: {discord_user_id}) -> {email} (updated {len(user_rows)} rows)")
-            else:
-                await message.channel.send(
-                    f"❌ Email `{email}` not found in our system.\n\n"
-                    f"Please make sure:\n"
-                    f"• You've completed your purchase\n"
-                    f"• You're using the exact email from your Shopify order\n"
-                    f"• Your order has been processed (may take a few minutes)\n\n"
-                    f"If you just purchased, wait 2-3 minutes and try again."
-                )
-                print(f"❌ Email not found in sheets: {email}")
+            await verify_email(message, email)
     
     await bot.process_commands(message)
 
+@profiled
+async def verify_email(message, email):
+    """Verify a DM'd email and assign the subscriber's roles"""
+    # Non-blocking sheet lookup
+    user_rows = await async_find_all_user_rows(email)
+    
+    # Lookup above refreshed the entitlement view for this email
+    entitlement = get_entitlement(email)
+
+    if user_rows and entitlement:
+        # Check if ANY row has a different Discord user already verified
+        current_user_id = str(message.author.id)
+        other_users = {
+            user_id: username
+            for user_id, username in entitlement['verified_users'].items()
+            if user_id != current_user_id
+        }
+
+        if other_users:
+            existing_discord_user_id, existing_username = next(iter(other_users.items()))
+            existing_username = existing_username or 'another user'
+            await message.channel.send(
+                f"🚫 **Email Already Registered**\n\n"
+                f"The email `{email}` is already linked to another Discord account (`{existing_username}`).\n\n"
+                f"If this is your email and you need to update your Discord account, please contact support."
+            )
+            print(f"⚠️ Blocked hijack attempt: {message.author.name} (ID: {current_user_id}) tried to use {email} (already owned by user ID {existing_discord_user_id})")
+            return
+
+        if not entitlement['has_access']:
+            await message.channel.send(
+                f"⚠️ **Setup Product Only**\n\n"
+                f"The email `{email}` is registered, but you only have the setup fee product.\n\n"
+                f"To get Discord access, you need to purchase a monthly or annual subscription. "
+                f"The setup fee alone does not grant server access."
+            )
+            print(f"⚠️ User {email} tried to verify but only has setup product")
+            return
+        
+        # If same user re-verifying
+        if current_user_id in entitlement['verified_users']:
+            await message.channel.send(
+                f"ℹ️ You've already verified this email!\n\n"
+                f"Your account is already linked and you have your role. "
+                f"If you're missing your role, please contact support."
+            )
+            return
+        
+        # New verification - update ALL rows (non-blocking)
+        discord_username = f"{message.author.name}"
+        discord_user_id = str(message.author.id)
+        await async_update_discord_verified(email, discord_username, discord_user_id, True)
+        
+        await message.channel.send(
+            f"✅ Email `{email}` verified!\n\n"
+            f"Your subscription is confirmed. Assigning your roles now..."
+        )
+        
+        # Assign roles
+        guild = bot.guilds[0] if bot.guilds else None
+        if guild:
+            member = guild.get_member(message.author.id)
+            if member:
+                assigned_roles = await assign_all_subscriber_roles(member, email)
+                
+                if assigned_roles:
+                    try:
+                        roles_text = ", ".join([f"**{r}**" for r in assigned_roles])
+                        await message.channel.send(
+                            f"🎉 **Subscription Activated!**\n\n"
+                            f"Your roles have been assigned: {roles_text}\n"
+                            f"You now have access to all premium channels!"
+                        )
+                    except discord.Forbidden:
+                        pass
+        
+        print(f"✅ Email verified: {message.author.name} (ID: {discord_user_id}) -> {email} (updated {len(user_rows)} rows)")
+    else:
+        await message.channel.send(
+            f"❌ Email `{email}` not found in our system.\n\n"
+            f"Please make sure:\n"
+            f"• You've completed your purchase\n"
+            f"• You're using the exact email from your Shopify order\n"
+            f"• Your order has been processed (may take a few minutes)\n\n"
+            f"If you just purchased, wait 2-3 minutes and try again."
+        )
+        print(f"❌ Email not found in sheets: {email}")
+
 async def assign_all_subscriber_roles(member, email):
     """Assign roles for ALL products the user has purchased"""
     try:
         guild = member.guild
         
-        # Get ALL user's products from sheets (non-blocking)
-        user_rows = await async_find_all_user_rows(email)
-        if not user_rows:
+        # Read precomputed roles; only hit sheets if this email was never loaded
+        entitlement = get_entitlement(email)
+        if entitlement is None:
+            await async_find_all_user_rows(email)
+            entitlement = get_entitlement(email)
+        if not entitlement:
             print(f"⚠️ Could not find user data for {email}")
             return []
-        
-        all_roles_to_assign = set()
-        
-        for row in user_rows:
-            status = row['data'].get('Status') or row['data'].get('Payment Status', 'Unknown')
-            
-            if status.upper() == 'PAID':
-                product_id = str(row['data'].get('Product ID', '')).strip()
-                role_names = PRODUCT_ROLE_MAP.get(product_id)
-                
-                if role_names:
-                    if isinstance(role_names, str):
-                        all_roles_to_assign.add(role_names)
-                    else:
-                        all_roles_to_assign.update(role_names)
-        
+
+        all_roles_to_assign = entitlement['roles']
+
         if not all_roles_to_assign:
             print(f"⚠️ No valid roles found for {email}")
             return []
         
-        assigned_roles = []
+        roles = []
         
         for role_name in all_roles_to_assign:
             role = discord.utils.get(guild.roles, name=role_name)
             
             if not role:
-                role = await guild.create_role(
-                    name=role_name,
-                    color=discord.Color.blue(),
-                    reason="Auto-created for subscription management"
-                )
+                with timer('discord.create_role'):
+                    role = await guild.create_role(
+                        name=role_name,
+                        color=discord.Color.blue(),
+                        reason="Auto-created for subscription management"
+                    )
                 print(f"Created new role: {role_name}")
             
-            await member.add_roles(role)
-            assigned_roles.append(role.name)
+            roles.append(role)
+        
+        # One member edit for all roles (atomic=True would send one request per role)
+        with timer('discord.add_roles'):
+            await member.add_roles(*roles, atomic=False)
+        assigned_roles = [role.name for role in roles]
         
         print(f"✅ Added roles {assigned_roles} to {member.name} ({email})")
         return assigned_roles
@@ -408,27 +765,56 @@ async def checksheet(ctx, email: str):
 async def syncsheets(ctx):
     """Sync all Active subscribers from Sheets (Admin only)"""
     try:
-        worksheet = await async_get_worksheet()
-        if not worksheet:
+        # Reload every row and rebuild the entitlement view (non-blocking)
+        records = await async_load_all_entitlements()
+        if records is None:
             await ctx.send("❌ Could not connect to Google Sheets")
             return
-        
-        # Run blocking get_all_records in executor
-        loop = asyncio.get_event_loop()
-        records = await loop.run_in_executor(None, worksheet.get_all_records)
         synced = 0
         
         for record in records:
-            payment_status = record.get('Payment Status') or record.get('Status', '')
-            discord_verified = record.get('Discord Verified', '').lower()
+            discord_verified = str(record.get('Discord Verified', '')).lower()
             
-            if payment_status.upper() == 'PAID' and discord_verified == 'yes':
+            if get_row_status(record) == 'PAID' and discord_verified == 'yes':
                 synced += 1
         
         await ctx.send(f"✅ Checked {len(records)} records, {synced} paid & verified subscribers")
     except Exception as e:
         await ctx.send(f"❌ Error: {e}")
 
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def profile(ctx, mode: str = ''):
+    """Turn profiling on/off or reset its data (Admin only)"""
+    global profiling_enabled
+    mode = mode.lower()
+    
+    if mode == 'on':
+        profiling_enabled = True
+        start_loop_lag_monitor()
+        await ctx.send(
+            "⏱️ Profiling enabled: call timings, Sheets helper cProfile stats "
+            "(combined per verify_email/process_webhook) and event loop lag. See `!hotspots`"
+        )
+    elif mode == 'off':
+        profiling_enabled = False
+        await ctx.send("⏱️ Profiling disabled (collected data kept until `!profile reset`)")
+    elif mode == 'reset':
+        reset_profiling()
+        await ctx.send("⏱️ Profiling data cleared")
+    else:
+        await ctx.send(f"Profiling is {'ON' if profiling_enabled else 'OFF'}. Usage: `!profile on|off|reset`")
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def hotspots(ctx, limit: int = 10):
+    """Show slowest timed calls, cumulative Sheets helper hot spots and event loop lag (Admin only)"""
+    report = format_hot_spots(limit)
+    # Keep within Discord's 2000 character message limit
+    if len(report) > 1900:
+        report = report[:1900] + "\n..."
+    await ctx.send(f"```\n{report}\n```")
+
 # ============================================
 # WEBHOOK ENDPOINT
 # ============================================
@@ -471,6 +857,7 @@ def webhook():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@profiled
 async def process_webhook(email, action, product_id):
     """Process webhook asynchronously - all blocking operations wrapped"""
     try:
@@ -481,17 +868,19 @@ async def process_webhook(email, action, product_id):
             print(f"❌ Email {email} not found in Google Sheets")
             return
         
+        # Lookup above refreshed the entitlement view for this email
+        entitlement = get_entitlement(email)
+        if not entitlement:
+            print(f"❌ Email {email} not found in Google Sheets")
+            return
+        
         # For add_role: Check verification
         if action == 'add_role':
-            discord_user_id = None
-            for row in user_rows:
-                row_product_id = str(row['data'].get('Product ID', '')).strip()
-                if row_product_id in ACCESS_PRODUCTS:
-                    if row['data'].get('Discord Verified', '').lower() == 'yes':
-                        discord_user_id = row['data'].get('Discord User ID', '')
-                        if discord_user_id:
-                            print(f"Found Discord User ID from ACCESS product: {row_product_id}")
-                            break
+            discord_user_id = next(
+                (user_id for pid, user_id in entitlement['verified_products'].items()
+                 if pid in ACCESS_PRODUCTS and user_id),
+                None
+            )
             
             if not discord_user_id:
                 print(f"No verified ACCESS_PRODUCT found for {email}")
@@ -499,60 +888,38 @@ async def process_webhook(email, action, product_id):
             
             # Setup products: Check if user has active subscription
             if product_id and product_id not in ACCESS_PRODUCTS:
-                has_active_access = False
-                for row in user_rows:
-                    row_product_id = str(row['data'].get('Product ID', '')).strip()
-                    status = row['data'].get('Status') or row['data'].get('Payment Status', 'Unknown')
-                    if row_product_id in ACCESS_PRODUCTS and status.upper() == 'PAID':
-                        has_active_access = True
-                        break
-                
-                if not has_active_access:
+                if not entitlement['has_access']:
                     print(f"Setup product {product_id} - user has no active subscription, tracking only")
                     return
                 
                 print(f"Setup product {product_id} - user has active subscription, will assign setup role")
         
-        # For remove_role/kick: Find the specific product row
+        # For remove_role/kick: Find the specific cancelled product
         elif action in ['remove_role', 'kick']:
-            target_row = None
+            cancelled_products = entitlement['cancelled_products']
             if product_id:
-                for row in user_rows:
-                    if str(row['data'].get('Product ID', '')).strip() == product_id:
-                        target_row = row
-                        break
+                if product_id not in entitlement['products']:
+                    print(f"❌ Product not found for removal/kick action")
+                    return
+                if product_id not in cancelled_products:
+                    print(f"❌ Product {product_id} is not REFUNDED or CANCELLED")
+                    return
             else:
                 print(f"No product_id specified, searching for cancelled ACCESS_PRODUCT")
-                for row in user_rows:
-                    row_product_id = str(row['data'].get('Product ID', '')).strip()
-                    payment_status = (row['data'].get('Payment Status') or row['data'].get('Status', '')).upper()
-                    
-                    if row_product_id in ACCESS_PRODUCTS and payment_status in ['REFUNDED', 'CANCELLED']:
-                        target_row = row
-                        product_id = row_product_id
-                        print(f"Found cancelled product: {row_product_id} with status {payment_status}")
-                        break
-            
-            if not target_row:
-                print(f"❌ Product not found for removal/kick action")
-                return
-            
-            payment_status = target_row['data'].get('Payment Status') or target_row['data'].get('Status', 'Unknown')
-            payment_status_upper = payment_status.upper()
-            
-            if payment_status_upper not in ['REFUNDED', 'CANCELLED']:
-                print(f"❌ Payment status is {payment_status}, must be REFUNDED or CANCELLED")
-                return
-            
-            print(f"Processing {action} for {email} with status: {payment_status}")
+                product_id = next((p for p in ACCESS_PRODUCTS if p in cancelled_products), None)
+                if not product_id:
+                    print(f"❌ Product not found for removal/kick action")
+                    return
+                print(f"Found cancelled product: {product_id}")
             
-            discord_verified = target_row['data'].get('Discord Verified', '').lower()
+            print(f"Processing {action} for {email} with cancelled product: {product_id}")
             
-            if discord_verified != 'yes':
+            # The cancelled product's own row must be verified
+            if product_id not in entitlement['verified_products']:
                 print(f"❌ User {email} has not verified Discord yet")
                 return
             
-            discord_user_id = target_row['data'].get('Discord User ID', '')
+            discord_user_id = entitlement['verified_products'][product_id]
         
         if not discord_user_id:
             print(f"❌ No Discord User ID for {email}")
@@ -586,8 +953,10 @@ async def handle_role_change_by_user_id(discord_user_id, action, email, product_
             print(f"Member not found in server: {discord_user_id}")
             return
         
-        # Get user rows (non-blocking)
-        user_rows = await async_find_all_user_rows(email)
+        entitlement = get_entitlement(email)
+        if not entitlement:
+            print(f"⚠️ No entitlement loaded for {email}")
+            return
         
         if action == 'add_role':
             assigned_roles = await assign_all_subscriber_roles(member, email)
@@ -611,22 +980,11 @@ async def handle_role_change_by_user_id(discord_user_id, action, email, product_
             
         elif action in ['remove_role', 'kick']:
             if product_id:
-                role_names = PRODUCT_ROLE_MAP.get(product_id)
+                role_names = get_product_roles([product_id])
             else:
-                role_names = []
-                for row in user_rows:
-                    pid = str(row['data'].get('Product ID', '')).strip()
-                    rnames = PRODUCT_ROLE_MAP.get(pid)
-                    if rnames:
-                        if isinstance(rnames, str):
-                            role_names.append(rnames)
-                        else:
-                            role_names.extend(rnames)
-                role_names = list(set(role_names))
+                role_names = get_product_roles(entitlement['products'])
             
-            if isinstance(role_names, str):
-                role_names = [role_names]
-            elif not role_names:
+            if not role_names:
                 role_names = ["Subscriber"]
             
             roles_to_modify = []
@@ -637,11 +995,11 @@ async def handle_role_change_by_user_id(discord_user_id, action, email, product_
                     roles_to_modify.append(role)
             
             if action == 'remove_role':
-                await member.remove_roles(*roles_to_modify)
+                with timer('discord.remove_roles'):
+                    await member.remove_roles(*roles_to_modify)
                 
                 # Update sheets (non-blocking)
-                user_row = next((r for r in user_rows if str(r['data'].get('Product ID', '')).strip() == product_id), user_rows[0])
-                discord_username = user_row['data'].get('Discord Username', '') if user_row else ''
+                discord_username = entitlement['discord_username']
                 await async_update_discord_verified(email, discord_username, discord_user_id, False)
                 
                 try:
@@ -658,11 +1016,11 @@ async def handle_role_change_by_user_id(discord_user_id, action, email, product_
                 print(f"❌ Removed roles {[r.name for r in roles_to_modify]} from {member.name} ({email})")
                 
             elif action == 'kick':
-                await member.remove_roles(*roles_to_modify)
+                with timer('discord.remove_roles'):
+                    await member.remove_roles(*roles_to_modify)
                 
                 # Update sheets (non-blocking)
-                user_row = next((r for r in user_rows if str(r['data'].get('Product ID', '')).strip() == product_id), user_rows[0])
-                discord_username = user_row['data'].get('Discord Username', '') if user_row else ''
+                discord_username = entitlement['discord_username']
                 await async_update_discord_verified(email, discord_username, discord_user_id, False)
                 
                 try:
@@ -676,7 +1034,8 @@ async def handle_role_change_by_user_id(discord_user_id, action, email, product_
                 
                 await asyncio.sleep(1)
                 
-                await member.kick(reason=f"Subscription cancelled for {email}")
+                with timer('discord.kick'):
+                    await member.kick(reason=f"Subscription cancelled for {email}")
                 
                 print(f"🚪 Kicked {member.name} ({email}) from server")
         